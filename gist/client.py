@@ -121,27 +121,12 @@ Commands:
 
 """
 
-import codecs
-import collections
-import locale
 import logging
 import os
-import platform
-import struct
 import sys
-import tempfile
-
-import docopt
-import gnupg
-import simplejson as json
 
 from . import gist
 
-if platform.system() != 'Windows':
-    # those modules exist everywhere but on Windows
-    import termios
-    import fcntl
-
 try:
     import configparser
 except ImportError:
@@ -154,10 +139,101 @@ if sys.version_info < (3, 2):
 
 logger = logging.getLogger('gist')
 
-# We need to wrap stdout in order to properly handle piping uincode output
-stream = sys.stdout.detach() if sys.version_info[0] > 2 else sys.stdout
-encoding = locale.getpreferredencoding()
-sys.stdout = codecs.getwriter(encoding)(stream)
+_IS_WINDOWS = os.name == 'nt'
+
+_stdout_wrapped = False
+
+
+def _wrap_stdout():
+    """Make sure that unicode output can be written to stdout
+
+    On python 3, stdout already handles unicode, so it is only reconfigured
+    to replace characters that cannot be encoded. Before python 3.7, which
+    added reconfigure(), the underlying buffer is re-wrapped with the same
+    encoding and errors='replace' instead. On python 2, stdout is wrapped in a
+    writer for the preferred encoding. This is deferred until a command
+    actually needs to print user content, and is only done once.
+
+    Streams that have neither reconfigure() nor an underlying buffer (e.g. a
+    StringIO) are left alone.
+
+    """
+    global _stdout_wrapped
+    if _stdout_wrapped:
+        return
+
+    if sys.version_info[0] > 2:
+        if hasattr(sys.stdout, 'reconfigure'):
+            sys.stdout.reconfigure(errors='replace')
+
+        elif hasattr(sys.stdout, 'buffer'):
+            import io
+
+            encoding = sys.stdout.encoding
+            line_buffering = sys.stdout.line_buffering
+            sys.stdout = io.TextIOWrapper(
+                    sys.stdout.detach(),
+                    encoding=encoding,
+                    errors='replace',
+                    line_buffering=line_buffering,
+                    )
+
+        else:
+            return
+
+    else:
+        import codecs
+        import locale
+
+        encoding = locale.getpreferredencoding()
+        sys.stdout = codecs.getwriter(encoding)(sys.stdout, errors='replace')
+
+    _stdout_wrapped = True
+
+
+def _write_bytes(data):
+    """Write bytes to stdout
+
+    If stdout has an underlying binary buffer the bytes are written to it
+    directly, which avoids decoding them only for stdout to encode them
+    again. Otherwise the bytes are decoded as UTF-8 and written as text.
+
+    Argument:
+        data: the bytes to write
+
+    """
+    buffer = getattr(sys.stdout, 'buffer', None)
+    if buffer is None:
+        sys.stdout.write(data.decode('utf-8', 'replace'))
+    else:
+        sys.stdout.flush()
+        buffer.write(data)
+
+
+# Files larger than this (in bytes) are memory mapped rather than read
+MMAP_THRESHOLD = 64 * 1024
+
+
+def read_file(path):
+    """Return the content of a file
+
+    Files larger than MMAP_THRESHOLD are memory mapped instead of being read,
+    so that their content is paged in from the page cache as it is used
+    rather than being copied into the process up front.
+
+    Argument:
+        path: the path to the file
+
+    Returns:
+        The content of the file as bytes, or as a read-only mmap object.
+
+    """
+    with open(path, 'rb') as fp:
+        if os.fstat(fp.fileno()).st_size <= MMAP_THRESHOLD:
+            return fp.read()
+
+        import mmap
+        return mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
 
 
 class GistError(Exception):
@@ -166,19 +242,46 @@ class GistError(Exception):
         self.msg = msg
 
 
-class FileInfo(collections.namedtuple("FileInfo", "name content")):
-    pass
+class FileInfo(object):
+    """A file to add to a gist
+
+    The content is kept as the raw bytes that were read, or as a read-only
+    mmap for large files, so that it can be passed to gnupg without an
+    intermediate decoded copy. It is only decoded when it is added to the gist
+    unencrypted.
+
+    """
+
+    __slots__ = ('name', 'content')
+
+    def __init__(self, name, content):
+        self.name = name
+        self.content = content
+
+
+_terminal_width = []
 
 
 def terminal_width():
     """Returns the terminal width
 
     Tries to determine the width of the terminal. If there is no terminal, then
-    None is returned instead.
+    None is returned instead. The width is only queried once; subsequent calls
+    return the cached value.
 
     """
+    if not _terminal_width:
+        _terminal_width.append(_query_terminal_width())
+
+    return _terminal_width[0]
+
+
+def _query_terminal_width():
+    """Query the terminal for its width, or return None if there is none"""
+    import struct
+
     try:
-        if platform.system() == "Windows":
+        if _IS_WINDOWS:
             from ctypes import windll, create_string_buffer
             # Reference: https://docs.microsoft.com/en-us/windows/console/getstdhandle # noqa
             hStdErr = -12
@@ -193,6 +296,9 @@ def terminal_width():
             tty_columns = right - left + 1
             return tty_columns
         else:
+            import fcntl
+            import termios
+
             exitcode = fcntl.ioctl(
                     0,
                     termios.TIOCGWINSZ,
@@ -203,7 +309,7 @@ def terminal_width():
         pass
 
 
-def elide(txt, width=terminal_width()):
+def elide(txt, width=None):
     """Elide the provided string
 
     The string is elided to the specified width, which defaults to the width of
@@ -217,6 +323,9 @@ def elide(txt, width=terminal_width()):
         A string that is no longer than the specified width.
 
     """
+    if width is None:
+        width = terminal_width()
+
     if width is not None and width > 3:
         try:
             if len(txt) > width:
@@ -227,309 +336,531 @@ def elide(txt, width=terminal_width()):
     return txt
 
 
-def alternative_editor(default):
-    """Return the path to the 'alternatives' editor
+def cache_dir():
+    """Return the path to the directory used to cache data between runs
 
-    Argument:
-        default: the default to use if the alternatives editor cannot be found.
+    The directory is 'gist' inside XDG_CACHE_HOME, or inside ~/.cache if the
+    XDG_CACHE_HOME environment variable is not set.
 
     """
-    if os.path.exists('/usr/bin/editor'):
-        return '/usr/bin/editor'
+    root = os.environ.get('XDG_CACHE_HOME', '').strip()
+    if root == '':
+        root = os.path.expanduser(os.sep.join(['~', '.cache']))
 
-    return default
+    return os.path.join(root, 'gist')
 
 
-def environment_editor(default):
-    """Return the user specified environment default
+def _read_cache(path):
+    """Return the object pickled at the given path
 
     Argument:
-        default: the default to use if the environment variable contains
-                nothing useful.
+        path: the path to the cache file
+
+    Returns:
+        The unpickled object, or None if the cache file is missing or cannot
+        be read.
 
     """
-    editor = os.environ.get('EDITOR', '').strip()
-    if editor != '':
-        return editor
+    import pickle
 
-    return default
+    try:
+        with open(path, 'rb') as fp:
+            return pickle.load(fp)
+    except Exception:
+        return None
 
 
-def configuration_editor(config, default):
-    """Return the editor in the config file
+def _write_cache(path, obj):
+    """Atomically pickle an object to the given path
 
-    Argument:
-        default: the default to use if there is no editor in the config
+    Failing to write the cache is not an error; it is simply logged.
+
+    Arguments:
+        path: the path to the cache file
+        obj:  the object to pickle
 
     """
+    import pickle
+
     try:
-        return config.get('gist', 'editor')
-    except configparser.NoOptionError:
-        return default
+        gist.write_atomic(path, pickle.dumps(obj, pickle.HIGHEST_PROTOCOL))
+    except Exception as e:
+        logger.debug(u'unable to write cache {}: {}'.format(path, e))
+
 
+def _load_config_cached(config_path):
+    """Return the parsed configuration file
 
-def alternative_config(default):
-    """Return the path to the config file in .config directory
+    The parsed configuration is cached on disk, keyed by the path, the
+    modification time and the size of the configuration file. If the key
+    matches, the configuration is rebuilt from the cache without parsing the
+    file.
+
+    Only the (raw) values of each section are cached, rather than the
+    ConfigParser object itself, because the internals of ConfigParser differ
+    between python 2 and python 3, which share the cache.
 
     Argument:
-        default: the default to use if ~/.config/gist does not exist.
+        config_path: the path to the configuration file
+
+    Returns:
+        A ConfigParser object
 
     """
-    config_path = os.path.expanduser(os.sep.join(['~', '.config', 'gist']))
-    if os.path.isfile(config_path):
-        return config_path
-    else:
-        return default
+    st = os.stat(config_path)
+    mtime = getattr(st, 'st_mtime_ns', st.st_mtime)
+    key = (config_path, mtime, st.st_size)
 
+    config = configparser.ConfigParser()
 
-def xdg_data_config(default):
-    """Return the path to the config file in XDG user config directory
+    cache_path = os.path.join(cache_dir(), 'config.pickle')
+    cached = _read_cache(cache_path)
+    if cached is not None and cached[0] == key and isinstance(cached[1], dict):
+        for section, values in cached[1].items():
+            config.add_section(section)
+            for option, value in values.items():
+                config.set(section, option, value)
 
-    Argument:
-        default: the default to use if either the XDG_DATA_HOME environment is
-            not set, or the XDG_DATA_HOME directory does not contain a 'gist'
-            file.
+        return config
 
-    """
-    config = os.environ.get('XDG_DATA_HOME', '').strip()
-    if config != '':
-        config_path = os.path.join(config, 'gist')
-        if os.path.isfile(config_path):
-            return config_path
+    with open(config_path) as fp:
+        config.read_file(fp)
 
-    return default
+    sections = {}
+    for section in config.sections():
+        sections[section] = dict(config.items(section, raw=True))
 
+    _write_cache(cache_path, (key, sections))
 
-def main(argv=sys.argv[1:], config=None):
-    args = docopt.docopt(
-            __doc__,
-            argv=argv,
-            version='gist-v{}'.format(gist.__version__),
-            )
+    return config
 
-    # Setup logging
-    fmt = "%(created).3f %(levelname)s[%(name)s] %(message)s"
-    logging.basicConfig(format=fmt)
 
-    # Read in the configuration file
-    if config is None:
-        config = configparser.ConfigParser()
-        config_path = os.path.expanduser(os.sep.join(['~', '.gist']))
-        config_path = alternative_config(config_path)
-        config_path = xdg_data_config(config_path)
-        try:
-            with open(config_path) as fp:
-                config.read_file(fp)
-        except Exception as e:
-            message = 'Unable to load configuration file: {0}'.format(e)
-            raise ValueError(message)
+def parse_args(argv, version):
+    """Parse the command line arguments against the usage in __doc__
 
-    try:
-        log_level = config.get('gist', 'log-level').upper()
-        logging.getLogger('gist').setLevel(log_level)
-    except Exception:
-        logging.getLogger('gist').setLevel(logging.ERROR)
+    This does the same as docopt.docopt(), except that the pattern compiled
+    (and fixed) from the usage is cached on disk. The cache file is keyed by a
+    hash of the usage and the docopt version, so that the usage is only parsed
+    again when either of them changes.
 
-    # Determine the editor to use
-    editor = None
-    editor = alternative_editor(editor)
-    editor = environment_editor(editor)
-    editor = configuration_editor(config, editor)
+    Arguments:
+        argv:    the list of arguments to parse
+        version: the version string printed by --version
 
-    if editor is None:
-        raise ValueError('Unable to find an editor.')
+    Returns:
+        A dict mapping the commands, arguments and options to their values
 
-    token = config.get('gist', 'token')
-    gapi = gist.GistAPI(token=token, editor=editor)
-
-    if args['list']:
-        logger.debug(u'action: list')
-        gists = gapi.list()
-        for info in gists:
-            public = '+' if info.public else '-'
-            desc = '' if info.desc is None else info.desc
-            line = u'{} {} {}'.format(info.id, public, desc)
+    """
+    import docopt
+
+    if not hasattr(docopt, 'TokenStream'):
+        return docopt.docopt(__doc__, argv=argv, version=version)
+
+    import hashlib
+
+    usage = docopt.printable_usage(__doc__)
+    key = hashlib.sha1((docopt.__version__ + __doc__).encode('utf-8'))
+    path = os.path.join(
+            cache_dir(),
+            'docopt-{}.pickle'.format(key.hexdigest()[:12]),
+            )
+
+    compiled = _read_cache(path)
+    if compiled is None:
+        options = docopt.parse_defaults(__doc__)
+        pattern = docopt.parse_pattern(docopt.formal_usage(usage), options)
+        compiled = (options, pattern.fix())
+        _write_cache(path, compiled)
+
+    options, pattern = compiled
+
+    # The usage does not contain '[options]', so the AnyOptions handling in
+    # docopt.docopt() is not needed here.
+    docopt.DocoptExit.usage = usage
+    argv = docopt.parse_argv(
+            docopt.TokenStream(argv, docopt.DocoptExit),
+            list(options),
+            False,
+            )
+    docopt.extras(True, version, argv, __doc__)
+    matched, left, collected = pattern.match(argv)
+    if matched and left == []:
+        return docopt.Dict(
+                (a.name, a.value) for a in (pattern.flat() + collected))
+
+    raise docopt.DocoptExit()
+
+
+def _cmd_list(args, gapi, config):
+    """List the gists of the user"""
+    logger.debug(u'action: list')
+    _wrap_stdout()
+    gists = gapi.list()
+    width = terminal_width()
+
+    # Format and elide every line up front so that the whole list can be
+    # written out with a single call.
+    lines = []
+    for info in gists:
+        line = u'{} {} {}'.format(
+                info.id, '+-'[not info.public], info.desc or '')
+        lines.append(elide(line, width))
+
+    if not lines:
+        return
+
+    # Characters that cannot be encoded are normally replaced by
+    # _wrap_stdout(). If stdout could not be wrapped, fall back to writing the
+    # lines individually so that only the gists that cannot be encoded are
+    # dropped.
+    try:
+        sys.stdout.write(u'\n'.join(lines) + u'\n')
+    except UnicodeEncodeError:
+        for info, line in zip(gists, lines):
             try:
-                print(elide(line))
+                sys.stdout.write(line + u'\n')
             except UnicodeEncodeError:
                 logger.error('unable to write gist {}'.format(info.id))
-        return
 
-    if args['info']:
-        gist_id = args['<id>']
-        logger.debug(u'action: info')
-        logger.debug(u'action: - {}'.format(gist_id))
-        info = gapi.info(gist_id)
-        print(json.dumps(info, indent=2))
-        return
 
-    if args['edit']:
-        gist_id = args['<id>']
-        logger.debug(u'action: edit')
-        logger.debug(u'action: - {}'.format(gist_id))
-        gapi.edit(gist_id)
-        return
+def _cmd_info(args, gapi, config):
+    """Print the information about a gist as JSON"""
+    gist_id = args['<id>']
+    logger.debug(u'action: info')
+    logger.debug(u'action: - {}'.format(gist_id))
+    info = gapi.info(gist_id)
 
-    if args['description']:
-        gist_id = args['<id>']
-        description = args['<desc>']
-        logger.debug(u'action: description')
-        logger.debug(u'action: - {}'.format(gist_id))
-        logger.debug(u'action: - {}'.format(description))
-        gapi.description(gist_id, description)
-        return
+    import json
+    print(json.dumps(info, indent=2))
 
-    if args['fork']:
-        gist_id = args['<id>']
-        logger.debug(u'action: fork')
-        logger.debug(u'action: - {}'.format(gist_id))
-        info = gapi.fork(gist_id)
-        return
 
-    if args['clone']:
-        gist_id = args['<id>']
-        gist_name = args['<name>']
-        logger.debug(u'action: clone')
-        logger.debug(u'action: - {} as {}'.format(gist_id, gist_name))
-        gapi.clone(gist_id, gist_name)
-        return
+def _cmd_edit(args, gapi, config):
+    """Edit the files in a gist"""
+    gist_id = args['<id>']
+    logger.debug(u'action: edit')
+    logger.debug(u'action: - {}'.format(gist_id))
+    gapi.edit(gist_id)
 
-    if args['content']:
-        gist_id = args['<id>']
-        logger.debug(u'action: content')
-        logger.debug(u'action: - {}'.format(gist_id))
 
-        content = gapi.content(gist_id)
-        gist_file = content.get(args['<filename>'])
+def _cmd_description(args, gapi, config):
+    """Update the description of a gist"""
+    gist_id = args['<id>']
+    description = args['<desc>']
+    logger.debug(u'action: description')
+    logger.debug(u'action: - {}'.format(gist_id))
+    logger.debug(u'action: - {}'.format(description))
+    gapi.description(gist_id, description)
 
-        if args['--decrypt']:
-            if not config.has_option('gist', 'gnupg-homedir'):
-                raise GistError('gnupg-homedir missing from config file')
 
-            homedir = config.get('gist', 'gnupg-homedir')
-            logger.debug(u'action: - {}'.format(homedir))
+def _cmd_fork(args, gapi, config):
+    """Fork a gist"""
+    gist_id = args['<id>']
+    logger.debug(u'action: fork')
+    logger.debug(u'action: - {}'.format(gist_id))
+    gapi.fork(gist_id)
 
-            gpg = gnupg.GPG(gnupghome=homedir, use_agent=True)
-            if gist_file is not None:
-                print(gpg.decrypt(gist_file).data.decode('utf-8'))
-            else:
-                for name, lines in content.items():
-                    lines = gpg.decrypt(lines).data.decode('utf-8')
-                    print(u'{} (decrypted):\n{}\n'.format(name, lines))
 
+def _cmd_clone(args, gapi, config):
+    """Clone a gist to the current directory"""
+    gist_id = args['<id>']
+    gist_name = args['<name>']
+    logger.debug(u'action: clone')
+    logger.debug(u'action: - {} as {}'.format(gist_id, gist_name))
+    gapi.clone(gist_id, gist_name)
+
+
+def _cmd_content(args, gapi, config):
+    """Print the content of the files in a gist"""
+    gist_id = args['<id>']
+    logger.debug(u'action: content')
+    logger.debug(u'action: - {}'.format(gist_id))
+
+    _wrap_stdout()
+
+    # If a filename is given only that file is decoded. If the gist does not
+    # contain it, the content of every file is printed instead.
+    content = gapi.content(gist_id, args['<filename>'])
+    gist_file = content.get(args['<filename>'])
+
+    if args['--decrypt']:
+        if not config.has_option('gist', 'gnupg-homedir'):
+            raise GistError('gnupg-homedir missing from config file')
+
+        homedir = config.get('gist', 'gnupg-homedir')
+        logger.debug(u'action: - {}'.format(homedir))
+
+        import gnupg
+        gpg = gnupg.GPG(gnupghome=homedir, use_agent=True)
+        decrypt = gpg.decrypt
+
+        # The decrypted bytes are written out as each file is decrypted,
+        # rather than being decoded and collected first.
+        if gist_file is not None:
+            _write_bytes(decrypt(gist_file).data)
+            sys.stdout.write(u'\n')
         else:
-            if gist_file is not None:
-                print(gist_file)
-            else:
-                for name, lines in content.items():
-                    print(u'{}:\n{}\n'.format(name, lines))
+            for name, lines in content.items():
+                sys.stdout.write(u'{} (decrypted):\n'.format(name))
+                _write_bytes(decrypt(lines).data)
+                sys.stdout.write(u'\n\n')
 
-        return
+    else:
+        if gist_file is not None:
+            print(gist_file)
+        else:
+            for name, lines in content.items():
+                print(u'{}:\n{}\n'.format(name, lines))
 
-    if args['files']:
-        gist_id = args['<id>']
-        logger.debug(u'action: files')
-        logger.debug(u'action: - {}'.format(gist_id))
-        for f in gapi.files(gist_id):
-            print(f)
-        return
 
-    if args['archive']:
-        gist_id = args['<id>']
-        logger.debug(u'action: archive')
-        logger.debug(u'action: - {}'.format(gist_id))
-        gapi.archive(gist_id)
+def _cmd_files(args, gapi, config):
+    """Print the names of the files in a gist"""
+    gist_id = args['<id>']
+    logger.debug(u'action: files')
+    logger.debug(u'action: - {}'.format(gist_id))
+    _wrap_stdout()
+    for f in gapi.files(gist_id):
+        print(f)
+
+
+def _cmd_archive(args, gapi, config):
+    """Download a gist as a tarball"""
+    gist_id = args['<id>']
+    logger.debug(u'action: archive')
+    logger.debug(u'action: - {}'.format(gist_id))
+    gapi.archive(gist_id)
+
+
+def _cmd_delete(args, gapi, config):
+    """Delete one or more gists"""
+    gist_ids = args['<ids>']
+    logger.debug(u'action: delete')
+
+    if len(gist_ids) == 1:
+        logger.debug(u'action: - {}'.format(gist_ids[0]))
+        gapi.delete(gist_ids[0])
         return
 
-    if args['delete']:
-        gist_ids = args['<ids>']
-        logger.debug(u'action: delete')
-        for gist_id in gist_ids:
-            logger.debug(u'action: - {}'.format(gist_id))
+    # Several gists are deleted concurrently, since each deletion is a
+    # separate round trip to github.
+    if config.has_option('gist', 'delete-concurrency'):
+        jobs = config.getint('gist', 'delete-concurrency')
+    else:
+        jobs = 8
+
+    def delete(gist_id):
+        logger.debug(u'action: - {}'.format(gist_id))
+        try:
             gapi.delete(gist_id)
-        return
+        except Exception as e:
+            logger.error(u'unable to delete {}: {}'.format(gist_id, e))
+            return gist_id
 
-    if args['version']:
-        logger.debug(u'action: version')
-        print('v{}'.format(gist.__version__))
-        return
+    from multiprocessing.pool import ThreadPool
 
-    if args['create']:
-        logger.debug('action: create')
+    pool = ThreadPool(max(1, min(jobs, len(gist_ids))))
+    try:
+        failed = [i for i in pool.map(delete, gist_ids) if i is not None]
+    finally:
+        pool.close()
+        pool.join()
 
-        # If encryption is selected, perform an initial check to make sure that
-        # it is possible before processing any data.
-        if args['--encrypt']:
-            if not config.has_option('gist', 'gnupg-homedir'):
-                raise GistError('gnupg-homedir missing from config file')
+    if failed:
+        raise GistError(u'unable to delete {}'.format(', '.join(failed)))
 
-            if not config.has_option('gist', 'gnupg-fingerprint'):
-                raise GistError('gnupg-fingerprint missing from config file')
 
-        # Retrieve the data to add to the gist
-        files = list()
+def _cmd_version(args, gapi, config):
+    """Print the version of gist"""
+    logger.debug(u'action: version')
+    print('v{}'.format(gist.__version__))
 
-        if sys.stdin.isatty():
-            if args['FILES']:
-                logger.debug('action: - reading from files')
-                for path in args['FILES']:
-                    name = os.path.basename(path)
-                    with open(path, 'rb') as fp:
-                        files.append(FileInfo(name, fp.read().decode('utf-8')))
 
-            else:
-                logger.debug('action: - reading from editor')
-                filename = args.get("<filename>", "file1.txt")
+def _cmd_create(args, gapi, config):
+    """Create a new gist"""
+    logger.debug('action: create')
 
-                # Determine whether the temporary file should be deleted
-                if config.has_option('gist', 'delete-tempfiles'):
-                    delete = config.getboolean('gist', 'delete-tempfiles')
-                else:
-                    delete = True
+    # If encryption is selected, perform an initial check to make sure that
+    # it is possible before processing any data.
+    if args['--encrypt']:
+        if not config.has_option('gist', 'gnupg-homedir'):
+            raise GistError('gnupg-homedir missing from config file')
 
-                with tempfile.NamedTemporaryFile('wb+', delete=delete) as fp:
-                    logger.debug('action: - created {}'.format(fp.name))
-                    os.system('{} {}'.format(editor, fp.name))
-                    fp.flush()
-                    fp.seek(0)
+        if not config.has_option('gist', 'gnupg-fingerprint'):
+            raise GistError('gnupg-fingerprint missing from config file')
 
-                    files.append(FileInfo(filename, fp.read().decode('utf-8')))
+    # Retrieve the data to add to the gist
+    files = list()
 
-                if delete:
-                    logger.debug('action: - removed {}'.format(fp.name))
+    if os.isatty(0):
+        if args['FILES']:
+            logger.debug('action: - reading from files')
+            for path in args['FILES']:
+                name = os.path.basename(path)
+                files.append(FileInfo(name, read_file(path)))
 
         else:
-            logger.debug('action: - reading from stdin')
+            logger.debug('action: - reading from editor')
             filename = args.get("<filename>", "file1.txt")
-            files.append(FileInfo(filename, sys.stdin.read()))
 
-        # Ensure that there are no empty files
+            # Determine whether the temporary file should be deleted
+            if config.has_option('gist', 'delete-tempfiles'):
+                delete = config.getboolean('gist', 'delete-tempfiles')
+            else:
+                delete = True
+
+            import tempfile
+
+            # The temporary file is closed before the editor is launched
+            # so that the editor is the only process with it open, and it
+            # is then re-opened to read what the editor wrote.
+            with tempfile.NamedTemporaryFile('wb', delete=False) as fp:
+                path = fp.name
+            logger.debug('action: - created {}'.format(path))
+
+            try:
+                gist.run_editor(gapi.editor, [path])
+                with open(path, 'rb') as fp:
+                    files.append(FileInfo(filename, fp.read()))
+
+            finally:
+                if delete:
+                    os.remove(path)
+                    logger.debug('action: - removed {}'.format(path))
+
+    else:
+        logger.debug('action: - reading from stdin')
+        filename = args.get("<filename>", "file1.txt")
+        stdin = getattr(sys.stdin, 'buffer', sys.stdin)
+        files.append(FileInfo(filename, stdin.read()))
+
+    # Ensure that there are no empty files
+    for file in files:
+        if len(file.content) == 0:
+            raise GistError("'{}' is empty".format(file.name))
+
+    description = args['<desc>']
+    public = args['--public']
+
+    # Encrypt the files or leave them unmodified
+    if args['--encrypt']:
+        logger.debug('action: - encrypting content')
+
+        fingerprint = config.get('gist', 'gnupg-fingerprint')
+        gnupghome = config.get('gist', 'gnupg-homedir')
+
+        import gnupg
+        import io
+        gpg = gnupg.GPG(gnupghome=gnupghome, use_agent=True)
+        encrypt_file = gpg.encrypt_file
+
+        # The content is streamed to gpg; mmap objects are file-like
+        # already. The fingerprint is named explicitly in the config file, so
+        # the key is trusted without consulting the trust database.
+        data = {}
         for file in files:
-            if len(file.content) == 0:
-                raise GistError("'{}' is empty".format(file.name))
+            stream = file.content
+            if isinstance(stream, bytes):
+                stream = io.BytesIO(stream)
+
+            cypher = encrypt_file(
+                    stream,
+                    fingerprint,
+                    armor=True,
+                    always_trust=True,
+                    )
+            data[file.name + '.asc'] = {
+                    'content': cypher.data.decode('utf-8'),
+                    }
+    else:
+        import codecs
+
+        # utf_8_decode accepts both bytes and mmap objects, so mapped files
+        # are decoded without first being copied into a bytes object.
+        data = {}
+        for file in files:
+            content = codecs.utf_8_decode(file.content, 'strict', True)[0]
+            data[file.name] = {'content': content}
+
+    # The mapped files are no longer needed once the payload has been built
+    for file in files:
+        if not isinstance(file.content, bytes):
+            file.content.close()
+
+    print(gapi.create(description, data, public))
+
+
+# Maps each command to the function that handles it
+DISPATCH = {
+        'list': _cmd_list,
+        'info': _cmd_info,
+        'edit': _cmd_edit,
+        'description': _cmd_description,
+        'fork': _cmd_fork,
+        'clone': _cmd_clone,
+        'content': _cmd_content,
+        'files': _cmd_files,
+        'archive': _cmd_archive,
+        'delete': _cmd_delete,
+        'version': _cmd_version,
+        'create': _cmd_create,
+        }
+
+
+def main(argv=sys.argv[1:], config=None):
+    args = parse_args(argv, 'gist-v{}'.format(gist.__version__))
 
-        description = args['<desc>']
-        public = args['--public']
+    # Setup logging
+    fmt = "%(created).3f %(levelname)s[%(name)s] %(message)s"
+    logging.basicConfig(format=fmt)
 
-        # Encrypt the files or leave them unmodified
-        if args['--encrypt']:
-            logger.debug('action: - encrypting content')
+    # Read in the configuration file
+    if config is None:
+        # The configuration file is taken from the first of these paths that
+        # exists, falling back to ~/.gist.
+        home = os.path.expanduser('~')
+        xdg_data_home = os.environ.get('XDG_DATA_HOME', '').strip()
+        candidates = [
+                os.path.join(xdg_data_home, 'gist') if xdg_data_home else None,
+                os.path.join(home, '.config', 'gist'),
+                ]
+        config_path = next(
+                (p for p in candidates if p and os.path.isfile(p)),
+                os.path.join(home, '.gist'),
+                )
+        try:
+            config = _load_config_cached(config_path)
+        except Exception as e:
+            message = 'Unable to load configuration file: {0}'.format(e)
+            raise ValueError(message)
+
+    try:
+        log_level = config.get('gist', 'log-level').upper()
+        logging.getLogger('gist').setLevel(log_level)
+    except Exception:
+        logging.getLogger('gist').setLevel(logging.ERROR)
 
-            fingerprint = config.get('gist', 'gnupg-fingerprint')
-            gnupghome = config.get('gist', 'gnupg-homedir')
+    # Determine the editor to use. The config file takes precedence over the
+    # EDITOR environment variable, which takes precedence over the
+    # 'alternatives' editor.
+    editor = (
+            (config.has_option('gist', 'editor') and
+                config.get('gist', 'editor')) or
+            os.environ.get('EDITOR', '').strip() or
+            ('/usr/bin/editor' if os.path.exists('/usr/bin/editor') else None)
+            )
 
-            gpg = gnupg.GPG(gnupghome=gnupghome, use_agent=True)
-            data = {}
-            for file in files:
-                cypher = gpg.encrypt(file.content.encode('utf-8'), fingerprint)
-                content = cypher.data.decode('utf-8')
+    if editor is None:
+        raise ValueError('Unable to find an editor.')
 
-                data['{}.asc'.format(file.name)] = {'content': content}
-        else:
-            data = {file.name: {'content': file.content} for file in files}
+    token = config.get('gist', 'token')
+    gapi = gist.GistAPI(
+            token=token,
+            editor=editor,
+            cache_dir=os.path.join(cache_dir(), 'responses'),
+            )
 
-        print(gapi.create(description, data, public))
-        return
+    for name, handler in DISPATCH.items():
+        if args.get(name):
+            return handler(args, gapi, config)
 
 
 if __name__ == "__main__":
@@ -1,13 +1,16 @@
 import base64
 import collections
 import contextlib
-import simplejson as json
+import functools
+import hashlib
+import json
 import os
 import re
 import requests
 import shutil
 import tarfile
 import tempfile
+import time
 
 __version__ = '0.8.1'
 
@@ -22,6 +25,75 @@ def pushd(path):
     os.chdir(original)
 
 
+def write_atomic(path, data):
+    """Atomically writes data to a file
+
+    The data are first written to a temporary file in the same directory,
+    which is then renamed over the file. The temporary file is created by
+    mkstemp, so the file is only readable by the user. The directory is
+    created if it does not exist.
+
+    Arguments:
+        path: the path to the file
+        data: the bytes to write
+
+    """
+    dirname = os.path.dirname(path)
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname, 0o700)
+
+    fd, tmp = tempfile.mkstemp(dir=dirname)
+    try:
+        with os.fdopen(fd, 'wb') as fp:
+            fp.write(data)
+        getattr(os, 'replace', os.rename)(tmp, path)
+    except Exception:
+        os.remove(tmp)
+        raise
+
+
+def editor_command(editor, paths):
+    """Returns the command that opens the given paths in the editor
+
+    On Windows the command is a string for the shell, so that the editor is
+    resolved the same way as at the command prompt (e.g. 'code --wait' runs
+    code.cmd), and so that an editor such as C:\\Windows\\notepad.exe does
+    not need to be quoted. Elsewhere the editor is split into its arguments
+    the way a shell would split it, and is run without a shell.
+
+    Arguments:
+        editor: the editor, which may include arguments
+        paths:  the paths to open in the editor
+
+    Returns:
+        A command that can be passed to the subprocess module
+
+    """
+    if os.name == 'nt':
+        quoted = ['"{}"'.format(path) for path in paths]
+        return ' '.join([editor] + quoted)
+
+    import shlex
+    return shlex.split(editor) + list(paths)
+
+
+def run_editor(editor, paths):
+    """Opens the given paths in the editor and waits for it to exit
+
+    Arguments:
+        editor: the editor, which may include arguments
+        paths:  the paths to open in the editor
+
+    Raises:
+        subprocess.CalledProcessError if the editor exits with an error
+
+    """
+    import subprocess
+
+    command = editor_command(editor, paths)
+    subprocess.check_call(command, shell=(os.name == 'nt'))
+
+
 class GistInfo(collections.namedtuple('GistInfo', 'id public desc')):
     pass
 
@@ -41,8 +113,6 @@ class authenticate(object):
 
         """
         self.func = func
-        self.owner = None
-        self.instance = None
         self.headers = {
                 'Accept-Encoding': 'identity, deflate, compress, gzip',
                 'User-Agent': 'python-requests/1.2.0',
@@ -91,36 +161,32 @@ class authenticate(object):
         return cls(func, method='DELETE')
 
     def __get__(self, instance, owner):
-        """Returns the __call__ method
+        """Returns the __call__ method bound to the instance
 
         This method is part of the data descriptor interface. It returns the
-        __call__ method, which wraps the original function.
+        __call__ method, which wraps the original function. The instance is
+        bound to the returned callable rather than stored on the decorator, so
+        that the same method can be called from several threads at once.
 
         """
-        self.instance = instance
-        self.owner = owner
-        return self.__call__
+        return functools.partial(self.__call__, instance)
 
-    def __call__(self, *args, **kwargs):
+    def __call__(self, instance, *args, **kwargs):
         """Wraps the original function and provides an initial request.
 
         The request object is created with the instance token as a query
         parameter, and specifies the required headers.
 
         """
-        try:
-            url = 'https://api.github.com/gists'
-            params = {'access_token': self.instance.token}
-            request = requests.Request(
-                    self.method,
-                    url,
-                    headers=self.headers,
-                    params=params,
-                    )
-            return self.func(self.instance, request, *args, **kwargs)
-        finally:
-            self.instance = None
-            self.owner = None
+        url = 'https://api.github.com/gists'
+        params = {'access_token': instance.token}
+        request = requests.Request(
+                self.method,
+                url,
+                headers=dict(self.headers),
+                params=params,
+                )
+        return self.func(instance, request, *args, **kwargs)
 
 
 class GistAPI(object):
@@ -128,24 +194,56 @@ class GistAPI(object):
     This class defines the interface to github.
     """
 
-    def __init__(self, token, editor=None):
+    # The maximum number of connections kept open to github
+    POOL_SIZE = 16
+
+    # The number of seconds a cached list of gists is used without asking
+    # github whether it has changed
+    LIST_MAX_AGE = 30
+
+    # The maximum number of cached responses, and the number of seconds after
+    # which a cached response that has not been revalidated is discarded
+    CACHE_SIZE = 64
+    CACHE_EXPIRY = 24 * 60 * 60
+
+    def __init__(self, token, editor=None, cache_dir=None):
         """Create a GistAPI object
 
         Arguments:
             token: an authentication token
             editor: path to the editor to use when editing a gist
+            cache_dir: path to a directory where GET responses are cached. If
+                this is None, responses are not cached.
 
         """
         self.token = token
         self.editor = editor
+        self.cache_dir = cache_dir
+
+        # Every request is sent to api.github.com through this session so
+        # that connections are kept alive and reused, including by concurrent
+        # requests from several threads.
+        adapter = requests.adapters.HTTPAdapter(
+                pool_connections=self.POOL_SIZE,
+                pool_maxsize=self.POOL_SIZE,
+                )
         self.session = requests.Session()
+        self.session.mount('https://', adapter)
 
-    def send(self, request, stem=None):
+    def send(self, request, stem=None, max_age=0):
         """Prepare and send a request
 
+        If the API has a cache directory, GET responses that carry an ETag
+        are cached. The cached ETag is sent with later requests for the same
+        URL, and if github replies that nothing has changed (304 Not
+        Modified) the cached response is returned instead. Any other request
+        (i.e. one that modifies a gist) clears the cache.
+
         Arguments:
             request: a Request object that is not yet prepared
             stem: a path to append to the root URL
+            max_age: the number of seconds a cached response is returned
+                without asking github whether it has changed
 
         Returns:
             The response to the request
@@ -161,11 +259,143 @@ class GistAPI(object):
                                                            verify=None,
                                                            cert=None)
 
+        cache_path = None
+        cached = None
+        if self.cache_dir is not None and prepped.method == 'GET':
+            key = hashlib.sha1(prepped.url.encode('utf-8')).hexdigest()
+            cache_path = os.path.join(self.cache_dir, key)
+            cached = self.read_cached_response(cache_path)
+
+        if cached is not None:
+            if time.time() - cached['time'] < max_age:
+                # Mark the response as recently used. The cache may have been
+                # pruned by another process in the meantime.
+                try:
+                    os.utime(cache_path, None)
+                except OSError:
+                    pass
+
+                return self.cached_response(prepped, cached)
+
+            prepped.headers['If-None-Match'] = cached['etag']
+
         response = self.session.send(prepped, **settings)
 
+        if cached is not None and response.status_code == 304:
+            cached['time'] = time.time()
+            self.write_cached_response(cache_path, cached)
+            return self.cached_response(prepped, cached)
+
         if not response.ok:
             response.raise_for_status()
 
+        if cache_path is not None:
+            if 'ETag' in response.headers:
+                self.write_cached_response(cache_path, {
+                    'etag': response.headers['ETag'],
+                    'time': time.time(),
+                    'headers': dict(response.headers),
+                    'body': response.content.decode('utf-8'),
+                    })
+
+        elif self.cache_dir is not None:
+            shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+        return response
+
+    def read_cached_response(self, path):
+        """Returns a cached response
+
+        Arguments:
+            path: the path to the cache file
+
+        Returns:
+            A dict containing the etag, time, headers and body of the cached
+            response, or None if there is no readable, complete and unexpired
+            cached response.
+
+        """
+        try:
+            with open(path, 'rb') as fp:
+                cached = json.loads(fp.read().decode('utf-8'))
+
+            for key in ('etag', 'time', 'headers', 'body'):
+                if key not in cached:
+                    return None
+
+            if time.time() - cached['time'] >= self.CACHE_EXPIRY:
+                return None
+
+            return cached
+
+        except Exception:
+            return None
+
+    def write_cached_response(self, path, cached):
+        """Atomically writes a response to the cache
+
+        Failing to write to the cache is not an error; the response is simply
+        not cached.
+
+        Arguments:
+            path: the path to the cache file
+            cached: a dict containing the etag, time, headers and body of the
+                response
+
+        """
+        try:
+            write_atomic(path, json.dumps(cached).encode('utf-8'))
+            self.prune_cached_responses()
+
+        except Exception:
+            pass
+
+    def prune_cached_responses(self):
+        """Removes old responses from the cache
+
+        Responses that have not been used or revalidated within CACHE_EXPIRY
+        seconds are removed, as are the least recently used responses beyond
+        the CACHE_SIZE most recent ones.
+
+        """
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            try:
+                entries.append((os.stat(path).st_mtime, path))
+            except OSError:
+                continue
+
+        entries.sort(reverse=True)
+
+        now = time.time()
+        for index, (mtime, path) in enumerate(entries):
+            if index >= self.CACHE_SIZE or now - mtime >= self.CACHE_EXPIRY:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def cached_response(self, prepped, cached):
+        """Returns a Response object constructed from a cached response
+
+        Arguments:
+            prepped: the prepared request the response is for
+            cached: a dict containing the headers and body of the response
+
+        Returns:
+            A Response object
+
+        """
+        response = requests.Response()
+        response.status_code = 200
+        response.reason = 'OK'
+        response.url = prepped.url
+        response.request = prepped
+        response.headers = requests.structures.CaseInsensitiveDict(
+                cached['headers'])
+        response.encoding = 'utf-8'
+        response._content = cached['body'].encode('utf-8')
         return response
 
     def list(self):
@@ -204,7 +434,7 @@ class GistAPI(object):
 
             # Retrieve the next page of gists
             try:
-                response = self.send(request).json()
+                response = self.send(request, max_age=self.LIST_MAX_AGE).json()
 
             except Exception:
                 break
@@ -305,24 +535,41 @@ class GistAPI(object):
         return gist['files']
 
     @authenticate.get
-    def content(self, request, id):
+    def content(self, request, id, filename=None):
         """Returns the content of the gist
 
+        If a filename is given and the gist contains a file with that name,
+        only that file is decoded and returned. If github has truncated the
+        content of that file in the gist information (which it does for large
+        files), the complete content is fetched from the raw URL of the file.
+
         Arguments:
-            request: an initial request object
-            id:      the gist identifier
+            request:  an initial request object
+            id:       the gist identifier
+            filename: the name of the only file to return
 
         Returns:
-            A dict containing the contents of each file in the gist
+            A dict containing the contents of each file in the gist, or only
+            the content of the given file if the gist contains it
 
         """
         gist = self.send(request, id).json()
 
+        files = gist['files']
+        if filename in files:
+            data = files[filename]
+            if data.get('truncated'):
+                response = self.session.get(data['raw_url'])
+                response.raise_for_status()
+                return {filename: response.content.decode('utf-8')}
+
+            files = {filename: data}
+
         def convert(data):
             return base64.b64decode(data).decode('utf-8')
 
         content = {}
-        for name, data in gist['files'].items():
+        for name, data in files.items():
             content[name] = convert(data['content'])
 
         return content
@@ -372,8 +619,7 @@ class GistAPI(object):
                 self.clone(id)
                 with pushd(id):
                     files = [f for f in os.listdir('.') if os.path.isfile(f)]
-                    quoted = ['"{}"'.format(f) for f in files]
-                    os.system("{} {}".format(self.editor, ' '.join(quoted)))
+                    run_editor(self.editor, files)
                     os.system('git commit -av && git push')
 
             finally:
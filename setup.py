@@ -39,7 +39,6 @@ setuptools.setup(
             'docopt',
             'python-gnupg>=0.4.1',
             'requests',
-            'simplejson',
             ],
         extras_require={
             "dev": [
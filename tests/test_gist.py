@@ -3,13 +3,18 @@
 
 import base64
 import contextlib
+import docopt
 import errno
+import hashlib
 import gnupg
 import os
+import pickle
 import shlex
+import shutil
 import subprocess
 import sys
 import tempfile
+import time
 import unittest
 
 try:
@@ -32,6 +37,23 @@ import gist
 import gist.client
 
 
+def setUpModule():
+    # Keep the caches written by the client out of the user's home directory
+    global cache_home, original_cache_home
+    cache_home = tempfile.mkdtemp()
+    original_cache_home = os.environ.get('XDG_CACHE_HOME')
+    os.environ['XDG_CACHE_HOME'] = cache_home
+
+
+def tearDownModule():
+    if original_cache_home is None:
+        os.environ.pop('XDG_CACHE_HOME', None)
+    else:
+        os.environ['XDG_CACHE_HOME'] = original_cache_home
+
+    shutil.rmtree(cache_home)
+
+
 def kill_gpg_agent(homedir):
     """Try to kill the spawned gpg-agent
 
@@ -158,6 +180,53 @@ class TestGist(unittest.TestCase):
         self.assertEqual(content['file-A.txt'], 'test-content-A')
         self.assertEqual(content['file-B.txt'], 'test-content-\u212C')
 
+    @responses.activate
+    def test_content_filename(self):
+        responses.add(responses.GET, 'https://api.github.com/gists/1',
+                body=json.dumps({
+                    "files": {
+                        "file-A.txt": {
+                            "filename": "file-A.txt",
+                            "content": b64encode("test-content-A"),
+                            },
+                        "file-B.txt": {
+                            "filename": "file-B.txt",
+                            "content": b64encode("test-content-\u212C"),
+                            },
+                        "file-C.txt": {
+                            "filename": "file-C.txt",
+                            "content": b64encode("test-content"),
+                            "truncated": True,
+                            "raw_url": "https://gist.githubusercontent.com/C",
+                            },
+                        },
+                    "description": "test-gist",
+                    "public": True,
+                    "id": 1,
+                    }),
+                status=200,
+                )
+        responses.add(responses.GET, 'https://gist.githubusercontent.com/C',
+                body=u'test-content-C-\u212C'.encode('utf-8'),
+                status=200,
+                )
+
+        api = gist.GistAPI(token='foo')
+
+        self.assertEqual(
+                api.content('1', 'file-B.txt'),
+                {'file-B.txt': 'test-content-\u212C'},
+                )
+        self.assertEqual(
+                api.content('1', 'file-C.txt'),
+                {'file-C.txt': 'test-content-C-\u212C'},
+                )
+
+        # If the gist does not contain the file, every file is returned
+        content = api.content('1', 'file-D.txt')
+        self.assertEqual(len(content), 3)
+        self.assertEqual(content['file-B.txt'], 'test-content-\u212C')
+
     @responses.activate
     def test_create(self):
         def request_handler(request):
@@ -194,6 +263,164 @@ class TestGist(unittest.TestCase):
         gist.GistAPI(token='foo').create(desc, files, public)
 
 
+class TestGistCache(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.api = gist.GistAPI(token='foo', cache_dir=self.cache_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    @responses.activate
+    def test_not_modified(self):
+        responses.add(responses.GET, 'https://api.github.com/gists/1',
+                body=json.dumps({'id': 1, 'description': 'test-desc-A'}),
+                headers={'ETag': '"test-etag"'},
+                status=200,
+                )
+
+        info = self.api.info('1')
+        self.assertEqual(info['description'], 'test-desc-A')
+
+        responses.replace(responses.GET, 'https://api.github.com/gists/1',
+                body='',
+                status=304,
+                )
+
+        info = self.api.info('1')
+        self.assertEqual(info['description'], 'test-desc-A')
+
+        self.assertEqual(len(responses.calls), 2)
+        request = responses.calls[1].request
+        self.assertEqual(request.headers['If-None-Match'], '"test-etag"')
+
+    @responses.activate
+    def test_incomplete(self):
+        """
+        A cache file that is missing fields is ignored rather than causing the
+        request to fail.
+
+        """
+        url = 'https://api.github.com/gists/1?access_token=foo'
+        key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        with open(os.path.join(self.cache_dir, key), 'w') as fp:
+            fp.write(json.dumps({'etag': '"test-etag"'}))
+
+        responses.add(responses.GET, 'https://api.github.com/gists/1',
+                body=json.dumps({'id': 1, 'description': 'test-desc-A'}),
+                status=200,
+                )
+
+        info = self.api.info('1')
+        self.assertEqual(info['description'], 'test-desc-A')
+
+        request = responses.calls[0].request
+        self.assertEqual(request.url, url)
+        self.assertNotIn('If-None-Match', request.headers)
+
+    @responses.activate
+    def test_prune(self):
+        self.api.CACHE_SIZE = 2
+
+        for gist_id in ('1', '2', '3'):
+            responses.add(
+                    responses.GET,
+                    'https://api.github.com/gists/{}'.format(gist_id),
+                    body=json.dumps({'id': gist_id}),
+                    headers={'ETag': '"test-etag-{}"'.format(gist_id)},
+                    status=200,
+                    )
+            self.api.info(gist_id)
+
+        self.assertEqual(len(os.listdir(self.cache_dir)), 2)
+
+    @responses.activate
+    def test_list_max_age(self):
+        responses.add(responses.GET, 'https://api.github.com/gists',
+                body=json.dumps([
+                    {
+                        'id': 1,
+                        'description': 'test-desc-A',
+                        'public': True,
+                        },
+                    ]),
+                headers={'ETag': '"test-etag"'},
+                status=200,
+                )
+
+        self.assertEqual(self.api.list()[0].desc, 'test-desc-A')
+        self.assertEqual(self.api.list()[0].desc, 'test-desc-A')
+        self.assertEqual(len(responses.calls), 1)
+
+    def test_pruned(self):
+        """
+        A fresh cached response is still returned if the cache file is removed
+        (e.g. by another process) after it has been read.
+
+        """
+        def read_cached_response(path):
+            return {
+                'etag': '"test-etag"',
+                'time': time.time(),
+                'headers': {},
+                'body': json.dumps([
+                    {
+                        'id': 1,
+                        'description': 'test-desc-A',
+                        'public': True,
+                        },
+                    ]),
+                }
+
+        self.api.read_cached_response = read_cached_response
+        self.assertEqual(self.api.list()[0].desc, 'test-desc-A')
+
+    @responses.activate
+    def test_invalidate(self):
+        responses.add(responses.GET, 'https://api.github.com/gists',
+                body=json.dumps([]),
+                headers={'ETag': '"test-etag"'},
+                status=200,
+                )
+        responses.add(responses.DELETE, 'https://api.github.com/gists/1',
+                status=204,
+                )
+
+        self.api.list()
+        self.api.delete('1')
+        self.api.list()
+
+        methods = [call.request.method for call in responses.calls]
+        self.assertEqual(methods, ['GET', 'DELETE', 'GET'])
+        self.assertNotIn('If-None-Match', responses.calls[2].request.headers)
+
+
+class TestGistEditor(unittest.TestCase):
+    def setUp(self):
+        self.os_name = os.name
+
+    def tearDown(self):
+        os.name = self.os_name
+
+    def test_posix(self):
+        os.name = 'posix'
+        command = gist.gist.editor_command(
+                'vim -c "set tw=79"', ['file A.txt', 'file-B.txt'])
+        self.assertEqual(
+                command,
+                ['vim', '-c', 'set tw=79', 'file A.txt', 'file-B.txt'],
+                )
+
+    def test_windows(self):
+        os.name = 'nt'
+        command = gist.gist.editor_command(
+                r'C:\Windows\notepad.exe', ['file A.txt', 'file-B.txt'])
+        self.assertEqual(
+                command,
+                r'C:\Windows\notepad.exe "file A.txt" "file-B.txt"',
+                )
+
+
 class TestGistCLI(unittest.TestCase):
     def setUp(self):
         os.environ["EDITOR"] = "gist-placeholder"
@@ -234,6 +461,43 @@ class TestGistCLI(unittest.TestCase):
         self.assertEqual(gistA, '1 + test-desc-A')
         self.assertEqual(gistB, '2 - test-desc-\u212C')
 
+    @responses.activate
+    def test_list_unencodable(self):
+        """
+        If stdout cannot encode a description (and cannot be reconfigured to
+        replace it), only that gist is dropped from the list.
+
+        """
+        class AsciiStream(object):
+            def __init__(self):
+                self.lines = []
+
+            def write(self, text):
+                text.encode('ascii')
+                self.lines.extend(text.splitlines())
+
+        responses.add(responses.GET, 'https://api.github.com/gists',
+                body=json.dumps([
+                    {
+                        'id': 1,
+                        'description': 'test-desc-A',
+                        'public': True,
+                        },
+                    {
+                        'id': 2,
+                        'description': 'test-desc-\u212C',
+                        'public': False,
+                        },
+                    ]),
+                status=200,
+                )
+
+        buf = AsciiStream()
+        with redirect_stdout(buf):
+            gist.client.main(argv=['list'], config=self.config)
+
+        self.assertEqual(buf.lines, ['1 + test-desc-A'])
+
     @responses.activate
     def test_content(self):
         def b64encode(s):
@@ -265,6 +529,121 @@ class TestGistCLI(unittest.TestCase):
         self.assertIn('file-B.txt:', lines)
         self.assertIn('test-content-\u212C', lines)
 
+        lines = self.command_response('content 1 file-B.txt')
+
+        self.assertEqual(lines, ['test-content-\u212C'])
+
+    @responses.activate
+    def test_delete(self):
+        for gist_id in ('1', '2', '3'):
+            responses.add(
+                    responses.DELETE,
+                    'https://api.github.com/gists/{}'.format(gist_id),
+                    status=204,
+                    )
+
+        self.command_response('delete 1 2 3')
+
+        urls = sorted(call.request.url for call in responses.calls)
+        self.assertEqual(len(urls), 3)
+        for url, gist_id in zip(urls, ('1', '2', '3')):
+            self.assertTrue(url.startswith(
+                'https://api.github.com/gists/{}?'.format(gist_id)))
+
+    @responses.activate
+    def test_delete_failure(self):
+        responses.add(responses.DELETE, 'https://api.github.com/gists/1',
+                status=204,
+                )
+        responses.add(responses.DELETE, 'https://api.github.com/gists/2',
+                status=404,
+                )
+
+        with self.assertRaises(gist.client.GistError) as cm:
+            self.command_response('delete 1 2')
+
+        self.assertEqual(cm.exception.msg, 'unable to delete 2')
+        self.assertEqual(len(responses.calls), 2)
+
+
+class TestGistConfig(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.environ = os.environ.copy()
+        os.environ['XDG_CACHE_HOME'] = os.path.join(self.tmpdir, 'cache')
+
+        self.config_path = os.path.join(self.tmpdir, 'gist')
+        self.write_config('[gist]\ntoken: foo\n')
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.environ)
+        shutil.rmtree(self.tmpdir)
+
+    def write_config(self, text):
+        with open(self.config_path, 'w') as fp:
+            fp.write(text)
+
+    def test_cached(self):
+        config = gist.client._load_config_cached(self.config_path)
+        self.assertEqual(config.get('gist', 'token'), 'foo')
+
+        cache_path = os.path.join(gist.client.cache_dir(), 'config.pickle')
+        self.assertTrue(os.path.isfile(cache_path))
+
+        # Only plain data is cached, so that the cache can be shared by
+        # different versions of python
+        with open(cache_path, 'rb') as fp:
+            key, sections = pickle.load(fp)
+        self.assertEqual(sections, {'gist': {'token': 'foo'}})
+
+        # The configuration file has not changed, so it must not be parsed
+        # again
+        def read_file(*args, **kwargs):
+            self.fail('the configuration file was parsed again')
+
+        original = configparser.ConfigParser.read_file
+        configparser.ConfigParser.read_file = read_file
+        try:
+            config = gist.client._load_config_cached(self.config_path)
+        finally:
+            configparser.ConfigParser.read_file = original
+
+        self.assertEqual(config.get('gist', 'token'), 'foo')
+
+    def test_modified(self):
+        gist.client._load_config_cached(self.config_path)
+
+        self.write_config('[gist]\ntoken: foobar\n')
+
+        config = gist.client._load_config_cached(self.config_path)
+        self.assertEqual(config.get('gist', 'token'), 'foobar')
+
+
+class TestGistArgs(unittest.TestCase):
+    commands = [
+            'list',
+            'delete 1 2 3',
+            'content 1 file-A.txt --decrypt',
+            'create "test-desc" --public --encrypt file-A.txt file-B.txt',
+            'create "test-desc" --filename file-A.txt',
+            'clone 1 test-name',
+            ]
+
+    def test_parse_args(self):
+        """
+        Check that the arguments parsed using the cached pattern (the second
+        time through) match those parsed by docopt itself.
+
+        """
+        for _ in range(2):
+            for cmd in self.commands:
+                argv = shlex.split(cmd)
+                self.assertEqual(
+                        gist.client.parse_args(argv, 'test-version'),
+                        docopt.docopt(gist.client.__doc__, argv=argv),
+                        )
+
 
 class TestGistGPG(unittest.TestCase):
     gnupghome = os.path.abspath('./tests/gnupg')
@@ -343,6 +722,41 @@ class TestGistGPG(unittest.TestCase):
             cmd = 'create --encrypt "test-desc" {}'.format(fp.name)
             self.command_response(cmd)
 
+    @responses.activate
+    def test_create_from_large_file(self):
+        """
+        Files larger than the mmap threshold are mapped rather than read. This
+        test checks that the content of such a file is properly encrypted.
+
+        """
+        text = u"test-content-\u212C\n" * gist.client.MMAP_THRESHOLD
+
+        def request_handler(request):
+            body = json.loads(request.body)
+            data = list(body['files'].values())
+            self.assertEqual(self.decrypt(data[0]['content']), text)
+
+            status = 200
+            headers = {}
+            body = json.dumps({
+                'html_url': 'https://gist.github.com/gists/1'
+                })
+            return status, headers, body
+
+        responses.add_callback(
+                responses.POST,
+                'https://api.github.com/gists',
+                callback=request_handler,
+                content_type='application/json',
+                )
+
+        with tempfile.NamedTemporaryFile("wb") as fp:
+            fp.write(text.encode('utf-8'))
+            fp.flush()
+
+            cmd = 'create --encrypt "test-desc" {}'.format(fp.name)
+            self.command_response(cmd)
+
     @responses.activate
     def test_content(self):
         """